@@ -1,6 +1,27 @@
 """Celery application configuration."""
+import socket
+import orjson
 from celery import Celery
+from celery.signals import worker_process_init
+from kombu.serialization import register
 from app.config import Config
+from app.database import engine
+
+# orjson encodes/decodes task payloads in C, several times faster than stdlib json
+register(
+    'orjson',
+    orjson.dumps,
+    orjson.loads,
+    content_type='application/x-orjson',
+    content_encoding='utf-8'
+)
+
+# TCP keepalive probes for broker/backend sockets (options not exposed by every OS are skipped)
+REDIS_KEEPALIVE_OPTIONS = {
+    getattr(socket, name): value
+    for name, value in (('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+    if hasattr(socket, name)
+}
 
 # Create Celery instance
 celery_app = Celery(
@@ -17,6 +38,15 @@ celery_app.conf.update(
     result_serializer=Config.CELERY_RESULT_SERIALIZER,
     timezone=Config.CELERY_TIMEZONE,
     enable_utc=Config.CELERY_ENABLE_UTC,
+    broker_pool_limit=Config.CELERY_BROKER_POOL_LIMIT,
+    broker_transport_options={
+        'socket_keepalive': True,
+        'socket_keepalive_options': REDIS_KEEPALIVE_OPTIONS,
+        'health_check_interval': Config.CELERY_BROKER_HEALTH_CHECK_INTERVAL,
+        'socket_timeout': 5,
+    },
+    redis_socket_keepalive=True,
+    redis_backend_health_check_interval=Config.CELERY_BROKER_HEALTH_CHECK_INTERVAL,
     beat_schedule={
         'fetch-users': {
             'task': 'app.tasks.fetch_users_task',
@@ -33,5 +63,14 @@ celery_app.conf.update(
     }
 )
 
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    """Give each forked worker process its own DB connection pool.
+    
+    Connections inherited from the parent are dropped without being closed,
+    so the parent's sockets are never shared or torn down by a child.
+    """
+    engine.dispose(close=False)
+
 if __name__ == '__main__':
     celery_app.start()
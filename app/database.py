@@ -1,12 +1,18 @@
 """Database configuration and models."""
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, func, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
 from app.config import Config
 
 # Create database engine
-engine = create_engine(Config.DATABASE_URL)
+engine = create_engine(
+    Config.DATABASE_URL,
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=Config.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,  # Transparently replace connections dropped by the server
+    pool_recycle=Config.DB_POOL_RECYCLE,
+    pool_use_lifo=True  # Reuse the most recently returned connection to keep a small hot set
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -24,8 +30,10 @@ class User(Base):
     company_name = Column(String(255))
     company_catchphrase = Column(Text)
     company_bs = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # default= renders now() into every INSERT, so tables created before the
+    # server defaults existed (create_tables never alters them) still get timestamps
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now())
     
     # Relationships
     addresses = relationship("Address", back_populates="user", cascade="all, delete-orphan")
@@ -36,15 +44,15 @@ class Address(Base):
     __tablename__ = "addresses"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     street_number = Column(String(20))
     street_name = Column(String(255))
     city = Column(String(100))
     state = Column(String(100))
     country = Column(String(100))
     postal_code = Column(String(20))
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="addresses")
@@ -54,24 +62,30 @@ class CreditCard(Base):
     __tablename__ = "credit_cards"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     card_number = Column(String(20))
     card_type = Column(String(50))
     expiry_date = Column(String(10))
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="credit_cards")
 
-def get_db():
-    """Get database session."""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def create_tables():
-    """Create all database tables."""
-    Base.metadata.create_all(bind=engine)
+def create_tables(bind=None):
+    """Create all database tables and any model indexes missing from existing ones."""
+    bind = engine if bind is None else bind
+    # A single catalog query covers the common case of an already initialised schema;
+    # create_all would otherwise probe every table individually
+    existing_tables = set(inspect(bind).get_table_names())
+    if not existing_tables.issuperset(Base.metadata.tables):
+        Base.metadata.create_all(bind=bind)
+    
+    # create_all never touches tables that already exist, so indexes added to the
+    # models later (e.g. on the user_id foreign keys) are created here
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=bind)
@@ -1,8 +1,8 @@
 """Service layer for business logic and data operations."""
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from app.database import User, Address, CreditCard, get_db_session
+from sqlalchemy import and_, func, distinct, exists, lambda_stmt, select
+from app.database import SessionLocal, User, Address, CreditCard
 
 class UserService:
     """Service class for user-related operations."""
@@ -10,78 +10,103 @@ class UserService:
     @staticmethod
     def get_user_by_external_id(external_id: int) -> Optional[User]:
         """Get user by external ID from JSONPlaceholder."""
-        db = get_db_session()
-        try:
-            return db.query(User).filter(User.external_id == external_id).first()
-        finally:
-            db.close()
+        with SessionLocal() as db:
+            # lambda_stmt caches the statement construct itself, not just its compiled SQL;
+            # external_id is extracted from the closure as a bound parameter
+            return db.execute(
+                lambda_stmt(lambda: select(User).where(User.external_id == external_id))
+            ).scalars().first()
     
     @staticmethod
     def get_user_with_relations(user_id: int) -> Optional[Dict[str, Any]]:
         """Get user with all related data (addresses and credit cards)."""
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.id == user_id).first()
+        with SessionLocal() as db:
+            # Read plain column rows instead of hydrating ORM instances on this read-only path
+            user = db.execute(
+                select(
+                    User.id,
+                    User.external_id,
+                    User.name,
+                    User.username,
+                    User.email,
+                    User.phone,
+                    User.website,
+                    User.company_name,
+                    User.company_catchphrase,
+                    User.company_bs,
+                    User.created_at,
+                    User.updated_at
+                ).where(User.id == user_id)
+            ).mappings().first()
             if not user:
                 return None
             
+            addresses = db.execute(
+                select(
+                    Address.id,
+                    Address.street_number,
+                    Address.street_name,
+                    Address.city,
+                    Address.state,
+                    Address.country,
+                    Address.postal_code,
+                    Address.created_at
+                ).where(Address.user_id == user_id).order_by(Address.id)
+            ).mappings().all()
+            
+            credit_cards = db.execute(
+                select(
+                    CreditCard.id,
+                    CreditCard.card_number,
+                    CreditCard.card_type,
+                    CreditCard.expiry_date,
+                    CreditCard.created_at
+                ).where(CreditCard.user_id == user_id).order_by(CreditCard.id)
+            ).mappings().all()
+            
             return {
-                'id': user.id,
-                'external_id': user.external_id,
-                'name': user.name,
-                'username': user.username,
-                'email': user.email,
-                'phone': user.phone,
-                'website': user.website,
-                'company_name': user.company_name,
-                'company_catchphrase': user.company_catchphrase,
-                'company_bs': user.company_bs,
-                'created_at': user.created_at.isoformat() if user.created_at else None,
-                'updated_at': user.updated_at.isoformat() if user.updated_at else None,
+                **user,
+                'created_at': user['created_at'].isoformat() if user['created_at'] else None,
+                'updated_at': user['updated_at'].isoformat() if user['updated_at'] else None,
                 'addresses': [
                     {
-                        'id': addr.id,
-                        'street_number': addr.street_number,
-                        'street_name': addr.street_name,
-                        'city': addr.city,
-                        'state': addr.state,
-                        'country': addr.country,
-                        'postal_code': addr.postal_code,
-                        'created_at': addr.created_at.isoformat() if addr.created_at else None
-                    } for addr in user.addresses
+                        **addr,
+                        'created_at': addr['created_at'].isoformat() if addr['created_at'] else None
+                    } for addr in addresses
                 ],
                 'credit_cards': [
                     {
-                        'id': card.id,
-                        'card_number': card.card_number,
-                        'card_type': card.card_type,
-                        'expiry_date': card.expiry_date,
-                        'created_at': card.created_at.isoformat() if card.created_at else None
-                    } for card in user.credit_cards
+                        **card,
+                        'created_at': card['created_at'].isoformat() if card['created_at'] else None
+                    } for card in credit_cards
                 ]
             }
-        finally:
-            db.close()
     
     @staticmethod
     def get_all_users(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
         """Get all users with pagination."""
-        db = get_db_session()
-        try:
-            users = db.query(User).offset(offset).limit(limit).all()
-            return [
-                {
-                    'id': user.id,
-                    'external_id': user.external_id,
-                    'name': user.name,
-                    'username': user.username,
-                    'email': user.email,
-                    'addresses_count': len(user.addresses),
-                    'credit_cards_count': len(user.credit_cards)
-                } for user in users
-            ]
-        finally:
-            db.close()
+        with SessionLocal() as db:
+            # Relationship counts are correlated subqueries per returned user, which
+            # avoids the addresses x credit_cards row product of joining both tables
+            rows = db.execute(
+                select(
+                    User.id,
+                    User.external_id,
+                    User.name,
+                    User.username,
+                    User.email,
+                    select(func.count(Address.id))
+                    .where(Address.user_id == User.id)
+                    .scalar_subquery().label('addresses_count'),
+                    select(func.count(CreditCard.id))
+                    .where(CreditCard.user_id == User.id)
+                    .scalar_subquery().label('credit_cards_count')
+                )
+                .order_by(User.id)
+                .offset(offset)
+                .limit(limit)
+            ).mappings().all()
+            return [dict(row) for row in rows]
 
 class AddressService:
     """Service class for address-related operations."""
@@ -89,9 +114,10 @@ class AddressService:
     @staticmethod
     def get_addresses_by_user_id(user_id: int) -> List[Dict[str, Any]]:
         """Get all addresses for a specific user."""
-        db = get_db_session()
-        try:
-            addresses = db.query(Address).filter(Address.user_id == user_id).all()
+        with SessionLocal() as db:
+            addresses = db.execute(
+                lambda_stmt(lambda: select(Address).where(Address.user_id == user_id))
+            ).scalars().all()
             return [
                 {
                     'id': addr.id,
@@ -104,8 +130,6 @@ class AddressService:
                     'created_at': addr.created_at.isoformat() if addr.created_at else None
                 } for addr in addresses
             ]
-        finally:
-            db.close()
 
 class CreditCardService:
     """Service class for credit card-related operations."""
@@ -113,9 +137,10 @@ class CreditCardService:
     @staticmethod
     def get_credit_cards_by_user_id(user_id: int) -> List[Dict[str, Any]]:
         """Get all credit cards for a specific user."""
-        db = get_db_session()
-        try:
-            cards = db.query(CreditCard).filter(CreditCard.user_id == user_id).all()
+        with SessionLocal() as db:
+            cards = db.execute(
+                lambda_stmt(lambda: select(CreditCard).where(CreditCard.user_id == user_id))
+            ).scalars().all()
             return [
                 {
                     'id': card.id,
@@ -125,8 +150,6 @@ class CreditCardService:
                     'created_at': card.created_at.isoformat() if card.created_at else None
                 } for card in cards
             ]
-        finally:
-            db.close()
 
 class StatsService:
     """Service class for statistics and analytics."""
@@ -134,25 +157,36 @@ class StatsService:
     @staticmethod
     def get_comprehensive_stats() -> Dict[str, Any]:
         """Get comprehensive statistics about the application."""
-        db = get_db_session()
-        try:
-            total_users = db.query(User).count()
-            total_addresses = db.query(Address).count()
-            total_credit_cards = db.query(CreditCard).count()
-            
-            # Users with addresses
-            users_with_addresses = db.query(User).join(Address).distinct().count()
-            
-            # Users with credit cards
-            users_with_credit_cards = db.query(User).join(CreditCard).distinct().count()
+        with SessionLocal() as db:
+            # All counts are scalar subqueries of one SELECT: a single round trip
+            counts = db.query(
+                select(func.count()).select_from(User).scalar_subquery().label('total_users'),
+                select(func.count()).select_from(Address).scalar_subquery().label('total_addresses'),
+                select(func.count()).select_from(CreditCard).scalar_subquery().label('total_credit_cards'),
+                # Users with addresses
+                select(func.count(distinct(Address.user_id))).scalar_subquery().label('users_with_addresses'),
+                # Users with credit cards
+                select(func.count(distinct(CreditCard.user_id))).scalar_subquery().label('users_with_credit_cards'),
+                # Users with both addresses and credit cards
+                # (EXISTS probes avoid the addresses x credit_cards row product of a join)
+                select(func.count())
+                .select_from(User)
+                .where(
+                    exists().where(Address.user_id == User.id),
+                    exists().where(CreditCard.user_id == User.id)
+                )
+                .scalar_subquery().label('users_with_both')
+            ).one()
             
-            # Users with both addresses and credit cards
-            users_with_both = db.query(User).join(Address).join(CreditCard).distinct().count()
+            total_users = counts.total_users
+            users_with_addresses = counts.users_with_addresses
+            users_with_credit_cards = counts.users_with_credit_cards
+            users_with_both = counts.users_with_both
             
             return {
                 'total_users': total_users,
-                'total_addresses': total_addresses,
-                'total_credit_cards': total_credit_cards,
+                'total_addresses': counts.total_addresses,
+                'total_credit_cards': counts.total_credit_cards,
                 'users_with_addresses': users_with_addresses,
                 'users_with_credit_cards': users_with_credit_cards,
                 'users_with_both': users_with_both,
@@ -162,5 +196,3 @@ class StatsService:
                     'full_coverage_percent': round((users_with_both / total_users * 100), 2) if total_users > 0 else 0
                 }
             }
-        finally:
-            db.close()
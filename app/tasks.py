@@ -1,9 +1,16 @@
 """Celery tasks for data fetching and processing."""
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from celery import chord, group
 from app.celery_app import celery_app
 from app.database import SessionLocal, User, Address, CreditCard
 from app.config import Config
@@ -12,9 +19,138 @@ from app.config import Config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db_session() -> Session:
-    """Get database session for tasks."""
-    return SessionLocal()
+# Shared HTTP session so keep-alive connections are reused across requests.
+# Each host pool holds one connection per concurrent request and blocks when
+# exhausted, so concurrent page fetches never open throwaway connections.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=Config.HTTP_CONCURRENCY,
+    pool_block=True,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+def _fetch_json(url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    """GET a URL and return its decoded JSON body."""
+    response = _session.get(
+        url,
+        params=params,
+        timeout=(Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+    )
+    response.raise_for_status()
+    return response.json()
+
+def _fetch_all(url: str, count: int) -> List[Any]:
+    """Fetch ``count`` random records from a Random Data API endpoint.
+    
+    Records are requested in pages of up to ``RANDOM_DATA_PAGE_SIZE`` through
+    the API's ``size`` parameter and the pages are fetched concurrently.
+    Results keep request order; every slot of a failed page holds the
+    exception so callers can skip those records without losing the rest.
+    """
+    page_size = Config.RANDOM_DATA_PAGE_SIZE
+    page_sizes = [min(page_size, count - start) for start in range(0, count, page_size)]
+    
+    def fetch_page(size):
+        try:
+            records = _fetch_json(url, params={'size': size})
+        except Exception as e:
+            return [e] * size
+        # A page of one may come back as a bare object instead of a list
+        if isinstance(records, dict):
+            records = [records]
+        missing = size - len(records)
+        if missing > 0:
+            records = records + [ValueError(f"API returned {len(records)} of {size} records")] * missing
+        return records[:size]
+    
+    max_workers = max(1, min(Config.HTTP_CONCURRENCY, len(page_sizes)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [record for page in executor.map(fetch_page, page_sizes) for record in page]
+
+def _is_postgres(db: Session) -> bool:
+    """Whether the session is bound to a PostgreSQL database."""
+    return db.get_bind().dialect.name == 'postgresql'
+
+def _refresh_table_stats(db: Session, model) -> None:
+    """ANALYZE a table after a bulk load so its planner row estimate stays current."""
+    if _is_postgres(db):
+        db.execute(text(f"ANALYZE {model.__tablename__}"))
+
+def _analyze_after_load(model) -> None:
+    """Refresh a table's planner statistics in a transaction of its own.
+    
+    ANALYZE takes a self-conflicting lock held until commit, so it runs once
+    per top-level fetch after every chunk has committed, never inside a
+    chunk's insert transaction.
+    """
+    with SessionLocal.begin() as db:
+        _refresh_table_stats(db, model)
+
+def _bulk_insert(model, rows: List[Dict[str, Any]]) -> None:
+    """Insert rows in one executemany round trip and commit."""
+    with SessionLocal.begin() as db:
+        db.execute(model.__table__.insert(), rows)
+
+def _table_row_counts(db: Session, models) -> Dict[str, int]:
+    """Row counts keyed by table name.
+    
+    On Postgres the planner's ``pg_class.reltuples`` estimates are read in one
+    O(1) query instead of running a full-scan COUNT(*) per table. Estimates of
+    -1 or 0 (never analysed, depending on the server version) and other
+    databases fall back to COUNT(*), which is cheap for a genuinely empty table.
+    """
+    counts = {}
+    if _is_postgres(db):
+        estimates = db.execute(
+            text(
+                "SELECT relname, reltuples::bigint FROM pg_class "
+                "WHERE relname = ANY(:names) AND relkind = 'r' AND pg_table_is_visible(oid)"
+            ),
+            {'names': [model.__tablename__ for model in models]}
+        )
+        counts = {name: estimate for name, estimate in estimates if estimate > 0}
+    for model in models:
+        if model.__tablename__ not in counts:
+            counts[model.__tablename__] = db.query(model).count()
+    return counts
+
+def _user_id_chunks() -> List[List[int]]:
+    """Split the ids of all users into chunks of ``FETCH_CHUNK_SIZE``."""
+    with SessionLocal() as db:
+        user_ids = [user_id for (user_id,) in db.query(User.id).order_by(User.id)]
+    
+    chunk_size = Config.FETCH_CHUNK_SIZE
+    return [user_ids[start:start + chunk_size] for start in range(0, len(user_ids), chunk_size)]
+
+def _build_user_row(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a JSONPlaceholder user payload onto User column values."""
+    company = user_data.get('company', {})
+    return {
+        'external_id': user_data['id'],
+        'name': user_data['name'],
+        'username': user_data['username'],
+        'email': user_data['email'],
+        'phone': user_data.get('phone', ''),
+        'website': user_data.get('website', ''),
+        'company_name': company.get('name', ''),
+        'company_catchphrase': company.get('catchPhrase', ''),
+        'company_bs': company.get('bs', '')
+    }
+
+def _upsert_users_stmt(db: Session, rows: List[Dict[str, Any]]):
+    """Build an INSERT ... ON CONFLICT (external_id) DO UPDATE for user rows."""
+    insert = sqlite_insert if db.get_bind().dialect.name == 'sqlite' else pg_insert
+    stmt = insert(User).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=['external_id'],
+        set_={
+            column.name: column for column in stmt.excluded
+            if column.name not in ('id', 'external_id', 'created_at')
+        }
+    )
 
 @celery_app.task(bind=True, max_retries=3)
 def fetch_users_task(self):
@@ -23,59 +159,56 @@ def fetch_users_task(self):
         logger.info("Starting fetch_users_task")
         
         # Fetch users from API
-        response = requests.get(Config.JSONPLACEHOLDER_USERS_URL, timeout=30)
-        response.raise_for_status()
-        users_data = response.json()
+        users_data = _fetch_json(Config.JSONPLACEHOLDER_USERS_URL)
         
-        db = get_db_session()
-        try:
-            created_count = 0
-            updated_count = 0
+        # One row per external_id (the last payload wins): Postgres rejects an
+        # ON CONFLICT DO UPDATE that would touch the same row twice
+        rows_by_external_id = {
+            user_data['id']: _build_user_row(user_data) for user_data in users_data
+        }
+        # Sorted by external_id so every run touches the unique index (and takes
+        # row locks) in the same order and new ids follow external_id order
+        rows = sorted(rows_by_external_id.values(), key=lambda row: row['external_id'])
+        if not rows:
+            logger.info("fetch_users_task completed: no users returned by API")
+            return {'status': 'success', 'created': 0, 'updated': 0, 'total_processed': 0}
+        
+        with SessionLocal() as db:
+            # One SELECT to split the batch into creates and updates for reporting
+            external_ids = [row['external_id'] for row in rows]
+            existing_ids = {
+                external_id for (external_id,) in
+                db.query(User.external_id).filter(User.external_id.in_(external_ids))
+            }
+            updated_count = len(existing_ids)
+            created_count = len(rows) - updated_count
             
-            for user_data in users_data:
-                try:
-                    # Check if user already exists
-                    existing_user = db.query(User).filter(
-                        User.external_id == user_data['id']
-                    ).first()
-                    
-                    if existing_user:
-                        # Update existing user
-                        existing_user.name = user_data['name']
-                        existing_user.username = user_data['username']
-                        existing_user.email = user_data['email']
-                        existing_user.phone = user_data.get('phone', '')
-                        existing_user.website = user_data.get('website', '')
-                        existing_user.company_name = user_data.get('company', {}).get('name', '')
-                        existing_user.company_catchphrase = user_data.get('company', {}).get('catchPhrase', '')
-                        existing_user.company_bs = user_data.get('company', {}).get('bs', '')
+            try:
+                # Single INSERT ... ON CONFLICT (external_id) DO UPDATE for the whole batch
+                db.execute(_upsert_users_stmt(db, rows))
+                db.commit()
+            except IntegrityError as e:
+                # A username/email clash fails the whole statement; retry row by row
+                # inside SAVEPOINTs so only the offending rows are discarded
+                logger.warning(f"Integrity error in users batch, retrying per row: {e}")
+                db.rollback()
+                created_count = updated_count = 0
+                for row in rows:
+                    try:
+                        with db.begin_nested():
+                            db.execute(_upsert_users_stmt(db, [row]))
+                    except IntegrityError as e:
+                        logger.warning(f"Integrity error for user {row['external_id']}: {e}")
+                        continue
+                    if row['external_id'] in existing_ids:
                         updated_count += 1
                     else:
-                        # Create new user
-                        new_user = User(
-                            external_id=user_data['id'],
-                            name=user_data['name'],
-                            username=user_data['username'],
-                            email=user_data['email'],
-                            phone=user_data.get('phone', ''),
-                            website=user_data.get('website', ''),
-                            company_name=user_data.get('company', {}).get('name', ''),
-                            company_catchphrase=user_data.get('company', {}).get('catchPhrase', ''),
-                            company_bs=user_data.get('company', {}).get('bs', '')
-                        )
-                        db.add(new_user)
                         created_count += 1
-                    
-                    db.commit()
-                    
-                except IntegrityError as e:
-                    logger.warning(f"Integrity error for user {user_data.get('id')}: {e}")
-                    db.rollback()
-                    continue
-                except Exception as e:
-                    logger.error(f"Error processing user {user_data.get('id')}: {e}")
-                    db.rollback()
-                    continue
+                db.commit()
+            
+            if created_count:
+                _refresh_table_stats(db, User)
+                db.commit()
             
             logger.info(f"fetch_users_task completed: {created_count} created, {updated_count} updated")
             return {
@@ -85,9 +218,6 @@ def fetch_users_task(self):
                 'total_processed': len(users_data)
             }
             
-        finally:
-            db.close()
-            
     except requests.RequestException as e:
         logger.error(f"Request error in fetch_users_task: {e}")
         raise self.retry(countdown=60, exc=e)
@@ -95,132 +225,191 @@ def fetch_users_task(self):
         logger.error(f"Unexpected error in fetch_users_task: {e}")
         raise self.retry(countdown=60, exc=e)
 
+# Models whose chunked loads are summarised by ``summarize_chunks``
+_CHUNKED_MODELS = {model.__tablename__: model for model in (Address, CreditCard)}
+
+@celery_app.task
+def summarize_chunks(results: List[Dict[str, Any]], table_name: str, created_key: str):
+    """Add up per-chunk results and refresh the loaded table's statistics once."""
+    created = sum(result[created_key] for result in results)
+    if created:
+        _analyze_after_load(_CHUNKED_MODELS[table_name])
+    
+    logger.info(f"{table_name} load completed: {created} rows created in {len(results)} chunks")
+    return {
+        'status': 'success',
+        created_key: created,
+        'users_processed': sum(result['users_processed'] for result in results)
+    }
+
+def _fan_out_chunks(task, chunk_task, chunks: List[List[int]], model, created_key: str):
+    """Replace ``task`` with a chord of chunk subtasks summed by ``summarize_chunks``.
+    
+    Callers get the same result shape as an inline single chunk, and chained
+    tasks wait for every chunk.
+    """
+    logger.info(f"{task.name} fanning out {len(chunks)} chunks")
+    workflow = chord(
+        group(chunk_task.s(chunk) for chunk in chunks),
+        summarize_chunks.s(model.__tablename__, created_key)
+    )
+    if task.request.called_directly:
+        return workflow.apply().get()
+    return task.replace(workflow)
+
 @celery_app.task(bind=True, max_retries=3)
 def fetch_addresses_task(self):
-    """Fetch address data for users and store in database."""
+    """Fetch address data for users and store in database.
+    
+    Users are split into chunks of ``FETCH_CHUNK_SIZE``. A single chunk is
+    processed inline; several chunks replace this task with a chord of
+    ``fetch_addresses_chunk`` subtasks so they run on different worker slots.
+    """
     try:
         logger.info("Starting fetch_addresses_task")
         
-        db = get_db_session()
-        try:
-            # Get all users
-            users = db.query(User).all()
-            if not users:
-                logger.warning("No users found for address fetching")
-                return {'status': 'success', 'message': 'No users found'}
-            
-            created_count = 0
-            
-            for user in users:
-                try:
-                    # Fetch random address data
-                    response = requests.get(Config.RANDOM_DATA_ADDRESS_URL, timeout=30)
-                    response.raise_for_status()
-                    address_data = response.json()
-                    
-                    # Create new address
-                    new_address = Address(
-                        user_id=user.id,
-                        street_number=address_data.get('street_number', ''),
-                        street_name=address_data.get('street_name', ''),
-                        city=address_data.get('city', ''),
-                        state=address_data.get('state', ''),
-                        country=address_data.get('country', ''),
-                        postal_code=address_data.get('postal_code', '')
-                    )
-                    db.add(new_address)
-                    created_count += 1
-                    
-                except requests.RequestException as e:
-                    logger.warning(f"Request error for user {user.id}: {e}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Error processing address for user {user.id}: {e}")
-                    continue
-            
-            db.commit()
-            logger.info(f"fetch_addresses_task completed: {created_count} addresses created")
-            return {
-                'status': 'success',
-                'addresses_created': created_count,
-                'users_processed': len(users)
-            }
-            
-        finally:
-            db.close()
+        chunks = _user_id_chunks()
+        if not chunks:
+            logger.warning("No users found for address fetching")
+            return {'status': 'success', 'message': 'No users found', 'addresses_created': 0}
+        
+        if len(chunks) == 1:
+            # Inline, so a failing chunk propagates here and the whole load is retried
+            return summarize_chunks([fetch_addresses_chunk(chunks[0])], Address.__tablename__, 'addresses_created')
             
     except Exception as e:
         logger.error(f"Unexpected error in fetch_addresses_task: {e}")
         raise self.retry(countdown=60, exc=e)
+    
+    return _fan_out_chunks(self, fetch_addresses_chunk, chunks, Address, 'addresses_created')
+
+@celery_app.task(bind=True, max_retries=3)
+def fetch_addresses_chunk(self, user_ids: List[int]):
+    """Fetch address data for a chunk of users and store in database."""
+    try:
+        rows = []
+        
+        # Fetch one random address per user in bulk pages
+        payloads = _fetch_all(Config.RANDOM_DATA_ADDRESS_URL, len(user_ids))
+        
+        for user_id, address_data in zip(user_ids, payloads):
+            try:
+                if isinstance(address_data, Exception):
+                    raise address_data
+                
+                rows.append({
+                    'user_id': user_id,
+                    'street_number': address_data.get('street_number', ''),
+                    'street_name': address_data.get('street_name', ''),
+                    'city': address_data.get('city', ''),
+                    'state': address_data.get('state', ''),
+                    'country': address_data.get('country', ''),
+                    'postal_code': address_data.get('postal_code', '')
+                })
+                
+            except requests.RequestException as e:
+                logger.warning(f"Request error for user {user_id}: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Error processing address for user {user_id}: {e}")
+                continue
+        
+        # Insert all collected addresses in one executemany round trip
+        if rows:
+            _bulk_insert(Address, rows)
+        
+        logger.info(f"fetch_addresses_chunk completed: {len(rows)} addresses created")
+        return {
+            'status': 'success',
+            'addresses_created': len(rows),
+            'users_processed': len(user_ids)
+        }
+        
+    except Exception as e:
+        logger.error(f"Unexpected error in fetch_addresses_chunk: {e}")
+        raise self.retry(countdown=60, exc=e)
 
 @celery_app.task(bind=True, max_retries=3)
 def fetch_credit_cards_task(self):
-    """Fetch credit card data for users and store in database."""
+    """Fetch credit card data for users and store in database.
+    
+    Users are split into chunks of ``FETCH_CHUNK_SIZE``. A single chunk is
+    processed inline; several chunks replace this task with a chord of
+    ``fetch_credit_cards_chunk`` subtasks so they run on different worker slots.
+    """
     try:
         logger.info("Starting fetch_credit_cards_task")
         
-        db = get_db_session()
-        try:
-            # Get all users
-            users = db.query(User).all()
-            if not users:
-                logger.warning("No users found for credit card fetching")
-                return {'status': 'success', 'message': 'No users found'}
-            
-            created_count = 0
-            
-            for user in users:
-                try:
-                    # Fetch random credit card data
-                    response = requests.get(Config.RANDOM_DATA_CREDIT_CARD_URL, timeout=30)
-                    response.raise_for_status()
-                    card_data = response.json()
-                    
-                    # Create new credit card
-                    new_card = CreditCard(
-                        user_id=user.id,
-                        card_number=card_data.get('credit_card_number', ''),
-                        card_type=card_data.get('credit_card_type', ''),
-                        expiry_date=card_data.get('credit_card_expiry_date', '')
-                    )
-                    db.add(new_card)
-                    created_count += 1
-                    
-                except requests.RequestException as e:
-                    logger.warning(f"Request error for user {user.id}: {e}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Error processing credit card for user {user.id}: {e}")
-                    continue
-            
-            db.commit()
-            logger.info(f"fetch_credit_cards_task completed: {created_count} credit cards created")
-            return {
-                'status': 'success',
-                'credit_cards_created': created_count,
-                'users_processed': len(users)
-            }
-            
-        finally:
-            db.close()
+        chunks = _user_id_chunks()
+        if not chunks:
+            logger.warning("No users found for credit card fetching")
+            return {'status': 'success', 'message': 'No users found', 'credit_cards_created': 0}
+        
+        if len(chunks) == 1:
+            # Inline, so a failing chunk propagates here and the whole load is retried
+            return summarize_chunks([fetch_credit_cards_chunk(chunks[0])], CreditCard.__tablename__, 'credit_cards_created')
             
     except Exception as e:
         logger.error(f"Unexpected error in fetch_credit_cards_task: {e}")
         raise self.retry(countdown=60, exc=e)
+    
+    return _fan_out_chunks(self, fetch_credit_cards_chunk, chunks, CreditCard, 'credit_cards_created')
 
-@celery_app.task
-def get_user_stats():
-    """Get statistics about users and their data."""
-    db = get_db_session()
+@celery_app.task(bind=True, max_retries=3)
+def fetch_credit_cards_chunk(self, user_ids: List[int]):
+    """Fetch credit card data for a chunk of users and store in database."""
     try:
-        total_users = db.query(User).count()
-        total_addresses = db.query(Address).count()
-        total_credit_cards = db.query(CreditCard).count()
+        rows = []
+        
+        # Fetch one random credit card per user in bulk pages
+        payloads = _fetch_all(Config.RANDOM_DATA_CREDIT_CARD_URL, len(user_ids))
         
+        for user_id, card_data in zip(user_ids, payloads):
+            try:
+                if isinstance(card_data, Exception):
+                    raise card_data
+                
+                rows.append({
+                    'user_id': user_id,
+                    'card_number': card_data.get('credit_card_number', ''),
+                    'card_type': card_data.get('credit_card_type', ''),
+                    'expiry_date': card_data.get('credit_card_expiry_date', '')
+                })
+                
+            except requests.RequestException as e:
+                logger.warning(f"Request error for user {user_id}: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Error processing credit card for user {user_id}: {e}")
+                continue
+        
+        # Insert all collected credit cards in one executemany round trip
+        if rows:
+            _bulk_insert(CreditCard, rows)
+        
+        logger.info(f"fetch_credit_cards_chunk completed: {len(rows)} credit cards created")
         return {
-            'total_users': total_users,
-            'total_addresses': total_addresses,
-            'total_credit_cards': total_credit_cards
+            'status': 'success',
+            'credit_cards_created': len(rows),
+            'users_processed': len(user_ids)
         }
-    finally:
-        db.close()
+        
+    except Exception as e:
+        logger.error(f"Unexpected error in fetch_credit_cards_chunk: {e}")
+        raise self.retry(countdown=60, exc=e)
+
+@celery_app.task
+def get_user_stats():
+    """Get statistics about users and their data.
+    
+    On Postgres the totals are planner estimates (see ``_table_row_counts``),
+    accurate to within a few percent; use ``StatsService`` for exact figures.
+    """
+    with SessionLocal() as db:
+        counts = _table_row_counts(db, (User, Address, CreditCard))
+    
+    return {
+        'total_users': counts[User.__tablename__],
+        'total_addresses': counts[Address.__tablename__],
+        'total_credit_cards': counts[CreditCard.__tablename__]
+    }
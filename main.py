@@ -1,6 +1,7 @@
 """Main application entry point for manual task execution and database initialization."""
 import sys
 import logging
+from celery import chain, group
 from app.database import create_tables
 from app.tasks import fetch_users_task, fetch_addresses_task, fetch_credit_cards_task, get_user_stats
 
@@ -22,25 +23,25 @@ def run_manual_tasks():
     try:
         logger.info("Running manual tasks...")
         
-        # Fetch users
-        logger.info("Fetching users...")
-        result = fetch_users_task.delay()
-        logger.info(f"Users task result: {result.get()}")
-        
-        # Fetch addresses
-        logger.info("Fetching addresses...")
-        result = fetch_addresses_task.delay()
-        logger.info(f"Addresses task result: {result.get()}")
-        
-        # Fetch credit cards
-        logger.info("Fetching credit cards...")
-        result = fetch_credit_cards_task.delay()
-        logger.info(f"Credit cards task result: {result.get()}")
+        # Users first, then addresses and credit cards in parallel, then stats.
+        # The whole workflow is published up front instead of one task at a time.
+        logger.info("Fetching users, addresses and credit cards...")
+        workflow = chain(
+            fetch_users_task.si(),
+            group(fetch_addresses_task.si(), fetch_credit_cards_task.si()),
+            get_user_stats.si()
+        )
+        result = workflow.apply_async()
+        stats = result.get()
         
-        # Get stats
-        logger.info("Getting user stats...")
-        result = get_user_stats.delay()
-        logger.info(f"User stats: {result.get()}")
+        # Walk back through the chain: stats <- (addresses, credit cards) group <- users
+        fetch_group = result.parent
+        users_result = fetch_group.parent.get()
+        addresses_result, credit_cards_result = (step.get() for step in fetch_group.results)
+        logger.info(f"Users: {users_result['created']} created, {users_result['updated']} updated")
+        logger.info(f"Addresses created: {addresses_result['addresses_created']}")
+        logger.info(f"Credit cards created: {credit_cards_result['credit_cards_created']}")
+        logger.info(f"User stats: {stats}")
         
     except Exception as e:
         logger.error(f"Error running manual tasks: {e}")
@@ -70,8 +71,9 @@ def show_stats():
     try:
         result = get_user_stats.delay()
         stats = result.get()
+        # On PostgreSQL get_user_stats reads planner estimates (see _table_row_counts)
         print(f"""
-User Statistics:
+User Statistics (approximate on PostgreSQL):
 - Total Users: {stats['total_users']}
 - Total Addresses: {stats['total_addresses']}
 - Total Credit Cards: {stats['total_credit_cards']}
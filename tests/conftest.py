@@ -1,50 +1,191 @@
 """Pytest configuration and fixtures."""
 import pytest
 import os
+import hashlib
 import tempfile
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from unittest.mock import patch, MagicMock
-from app.database import Base, get_db_session
+from app.database import Base, SessionLocal, User
 from app.celery_app import celery_app
 from app.config import Config
 
-# Test database URL
-TEST_DATABASE_URL = "sqlite:///./test.db"
+# Test database URL (in-memory, shared through a StaticPool). Every pytest-xdist
+# worker is a separate process, so each one gets its own private database.
+TEST_DATABASE_URL = "sqlite://"
+
+# Statements that only manage transactions and are ignored by assert_max_queries
+TRANSACTION_CONTROL_PREFIXES = ("BEGIN", "SAVEPOINT", "RELEASE", "ROLLBACK", "COMMIT")
+
+# Directory holding schema-only SQLite files for --reuse-db
+TEST_DB_CACHE_DIR = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "celeryapp-tests"
+)
+
+def pytest_addoption(parser):
+    """Register the test database reuse options."""
+    group = parser.getgroup("celeryapp")
+    group.addoption(
+        "--reuse-db", action="store_true", default=False,
+        help="Keep the test schema in a cached SQLite file and reuse it across runs."
+    )
+    group.addoption(
+        "--create-db", action="store_true", default=False,
+        help="Rebuild the cached test schema (implies --reuse-db)."
+    )
+
+def _schema_hash():
+    """Hash of the DDL for every model table, so model edits invalidate the cache."""
+    dialect = sqlite.dialect()
+    ddl = []
+    for table in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl.extend(str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes)
+    return hashlib.sha1("\n".join(ddl).encode()).hexdigest()[:16]
+
+def _test_database_url(config):
+    """In-memory URL by default; a cached per-schema, per-worker file with --reuse-db."""
+    create_db = config.getoption("--create-db")
+    if not (config.getoption("--reuse-db") or create_db):
+        return TEST_DATABASE_URL
+    
+    worker = os.getenv("PYTEST_XDIST_WORKER", "main")
+    path = os.path.join(TEST_DB_CACHE_DIR, f"{_schema_hash()}-{worker}.db")
+    os.makedirs(TEST_DB_CACHE_DIR, exist_ok=True)
+    if create_db and os.path.exists(path):
+        os.remove(path)
+    return f"sqlite:///{path}"
 
 @pytest.fixture(scope="session")
-def test_engine():
-    """Create test database engine."""
-    engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
+def test_engine(pytestconfig):
+    """Create test database engine and schema once per test session (per xdist worker)."""
+    engine = create_engine(
+        _test_database_url(pytestconfig),
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    
+    @event.listens_for(engine, "connect")
+    def configure_sqlite(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+        # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work with pysqlite
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def begin_sqlite(connection):
+        connection.exec_driver_sql("BEGIN")
+    
+    # Skips existing tables, so a reused schema file costs only the table probe
     Base.metadata.create_all(bind=engine)
-    return engine
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(scope="function", autouse=True)
+def test_connection(test_engine):
+    """Run each test inside an outer transaction that is rolled back afterwards.
+    
+    Application sessions are bound to the same connection and only ever commit
+    SAVEPOINTs, so nothing a test writes outlives it and no schema is rebuilt.
+    """
+    connection = test_engine.connect()
+    transaction = connection.begin()
+    # SessionLocal is the application's global factory: restore its settings afterwards
+    previous_kw = dict(SessionLocal.kw)
+    SessionLocal.configure(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield connection
+    finally:
+        SessionLocal.kw.clear()
+        SessionLocal.kw.update(previous_kw)
+        transaction.rollback()
+        connection.close()
 
 @pytest.fixture(scope="function")
-def test_db(test_engine):
+def test_db(test_connection):
     """Create test database session."""
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+    TestingSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=test_connection,
+        join_transaction_mode="create_savepoint"
+    )
     session = TestingSessionLocal()
     try:
         yield session
     finally:
         session.close()
 
+@pytest.fixture(scope="function")
+def assert_max_queries(test_engine):
+    """Context manager failing the test if a block sends more than ``n`` statements.
+    
+    Reads and writes both count (an executemany is one statement); transaction
+    control (BEGIN, SAVEPOINT, RELEASE, ROLLBACK) does not. Usage:
+    ``with assert_max_queries(3): ...``. The recorded statements are yielded so
+    a failing assertion can show what was actually run.
+    """
+    @contextmanager
+    def check(n):
+        statements = []
+        
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            if not statement.lstrip().upper().startswith(TRANSACTION_CONTROL_PREFIXES):
+                statements.append(statement)
+        
+        event.listen(test_engine, "before_cursor_execute", record_statement)
+        try:
+            yield statements
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record_statement)
+        assert len(statements) <= n, (
+            f"Expected at most {n} queries, got {len(statements)}:\n" + "\n".join(statements)
+        )
+    
+    return check
+
+@pytest.fixture(scope="function")
+def basic_user(test_db):
+    """Create the standard test user inside the test transaction.
+    
+    The user is only flushed: that assigns its id and makes the row visible on
+    the shared test connection, and the test's own commit (if any) covers it.
+    """
+    user = User(
+        external_id=1,
+        name="Test User",
+        username="testuser",
+        email="test@example.com"
+    )
+    test_db.add(user)
+    test_db.flush()
+    return user
+
 @pytest.fixture(scope="function")
 def mock_requests():
     """Mock requests for API calls."""
-    with patch('requests.get') as mock_get:
+    with patch('app.tasks._session.get') as mock_get:
         yield mock_get
 
 @pytest.fixture(scope="function")
 def celery_app_test():
-    """Test Celery app configuration."""
-    celery_app.conf.update(
-        task_always_eager=True,
-        task_eager_propagates=True,
-        broker_url='memory://',
-        result_backend='cache+memory://'
-    )
-    return celery_app
+    """Test Celery app configuration, restored after the test."""
+    settings = {
+        'task_always_eager': True,
+        'task_eager_propagates': True,
+        'broker_url': 'memory://',
+        'result_backend': 'cache+memory://'
+    }
+    previous = {key: celery_app.conf[key] for key in settings}
+    celery_app.conf.update(settings)
+    try:
+        yield celery_app
+    finally:
+        celery_app.conf.update(previous)
 
 @pytest.fixture
 def sample_user_data():
@@ -1,8 +1,9 @@
 """Tests for database models and operations."""
 import pytest
 from datetime import datetime
+from sqlalchemy import event, inspect, select
 from sqlalchemy.exc import IntegrityError
-from app.database import User, Address, CreditCard
+from app.database import User, Address, CreditCard, create_tables
 
 class TestUserModel:
     """Test User model."""
@@ -39,7 +40,7 @@ class TestUserModel:
             email="user1@example.com"
         )
         test_db.add(user1)
-        test_db.commit()
+        test_db.flush()
         
         # Try to create user with same external_id
         user2 = User(
@@ -53,20 +54,11 @@ class TestUserModel:
         with pytest.raises(IntegrityError):
             test_db.commit()
     
-    def test_user_relationships(self, test_db):
+    def test_user_relationships(self, test_db, basic_user):
         """Test user relationships with addresses and credit cards."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         # Add address
         address = Address(
-            user_id=user.id,
+            user_id=basic_user.id,
             street_number="123",
             street_name="Main St",
             city="Test City",
@@ -74,40 +66,30 @@ class TestUserModel:
             country="Test Country",
             postal_code="12345"
         )
-        test_db.add(address)
         
         # Add credit card
         credit_card = CreditCard(
-            user_id=user.id,
+            user_id=basic_user.id,
             card_number="1234-5678-9012-3456",
             card_type="visa",
             expiry_date="12/25"
         )
-        test_db.add(credit_card)
+        test_db.add_all([address, credit_card])
         test_db.commit()
         
         # Test relationships
-        assert len(user.addresses) == 1
-        assert len(user.credit_cards) == 1
-        assert user.addresses[0].street_name == "Main St"
-        assert user.credit_cards[0].card_number == "1234-5678-9012-3456"
+        assert len(basic_user.addresses) == 1
+        assert len(basic_user.credit_cards) == 1
+        assert basic_user.addresses[0].street_name == "Main St"
+        assert basic_user.credit_cards[0].card_number == "1234-5678-9012-3456"
 
 class TestAddressModel:
     """Test Address model."""
     
-    def test_create_address(self, test_db):
+    def test_create_address(self, test_db, basic_user):
         """Test creating an address."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         address = Address(
-            user_id=user.id,
+            user_id=basic_user.id,
             street_number="123",
             street_name="Main Street",
             city="New York",
@@ -119,10 +101,21 @@ class TestAddressModel:
         test_db.commit()
         
         assert address.id is not None
-        assert address.user_id == user.id
+        assert address.user_id == basic_user.id
         assert address.street_name == "Main Street"
         assert address.city == "New York"
     
+    def test_core_insert_sets_timestamps(self, test_db, basic_user):
+        """Test that bulk Core inserts, which omit the timestamp columns, still fill them."""
+        test_db.execute(Address.__table__.insert(), [
+            {"user_id": basic_user.id, "street_number": str(i), "street_name": "Main St", "city": "Test City"}
+            for i in range(2)
+        ])
+        
+        timestamps = test_db.execute(select(Address.created_at, Address.updated_at)).all()
+        assert len(timestamps) == 2
+        assert all(created_at is not None and updated_at is not None for created_at, updated_at in timestamps)
+    
     def test_address_foreign_key_constraint(self, test_db):
         """Test address foreign key constraint."""
         address = Address(
@@ -139,19 +132,10 @@ class TestAddressModel:
 class TestCreditCardModel:
     """Test CreditCard model."""
     
-    def test_create_credit_card(self, test_db):
+    def test_create_credit_card(self, test_db, basic_user):
         """Test creating a credit card."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         credit_card = CreditCard(
-            user_id=user.id,
+            user_id=basic_user.id,
             card_number="4532-1234-5678-9012",
             card_type="visa",
             expiry_date="12/25"
@@ -160,7 +144,7 @@ class TestCreditCardModel:
         test_db.commit()
         
         assert credit_card.id is not None
-        assert credit_card.user_id == user.id
+        assert credit_card.user_id == basic_user.id
         assert credit_card.card_number == "4532-1234-5678-9012"
         assert credit_card.card_type == "visa"
     
@@ -176,3 +160,32 @@ class TestCreditCardModel:
         
         with pytest.raises(IntegrityError):
             test_db.commit()
+
+class TestCreateTables:
+    """Test create_tables."""
+    
+    def test_adds_missing_indexes_to_existing_tables(self, test_connection):
+        """Test that indexes absent from an existing schema are created."""
+        test_connection.exec_driver_sql("DROP INDEX ix_addresses_user_id")
+        test_connection.exec_driver_sql("DROP INDEX ix_credit_cards_user_id")
+        
+        create_tables(test_connection)
+        
+        inspector = inspect(test_connection)
+        assert "ix_addresses_user_id" in {index['name'] for index in inspector.get_indexes("addresses")}
+        assert "ix_credit_cards_user_id" in {index['name'] for index in inspector.get_indexes("credit_cards")}
+    
+    def test_existing_schema_is_left_unchanged(self, test_connection):
+        """Test that a complete schema needs no DDL."""
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(test_connection, "before_cursor_execute", record)
+        try:
+            create_tables(test_connection)
+        finally:
+            event.remove(test_connection, "before_cursor_execute", record)
+        
+        assert not [statement for statement in statements if statement.lstrip().upper().startswith("CREATE")]
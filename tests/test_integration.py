@@ -5,49 +5,60 @@ from app.tasks import fetch_users_task, fetch_addresses_task, fetch_credit_cards
 from app.services import UserService, StatsService
 from app.database import User, Address, CreditCard
 
+@pytest.fixture(scope="session")
+def users_response():
+    """JSONPlaceholder users response shared by the flow tests."""
+    response = MagicMock()
+    response.json.return_value = [
+        {
+            "id": 1,
+            "name": "John Doe",
+            "username": "johndoe",
+            "email": "john@example.com",
+            "phone": "123-456-7890",
+            "website": "johndoe.com",
+            "company": {
+                "name": "Test Company",
+                "catchPhrase": "Test Catchphrase",
+                "bs": "Test BS"
+            }
+        }
+    ]
+    response.raise_for_status.return_value = None
+    return response
+
+@pytest.fixture(scope="session")
+def address_response():
+    """Random Data API address response shared by the flow tests."""
+    response = MagicMock()
+    response.json.return_value = {
+        "street_number": "123",
+        "street_name": "Main Street",
+        "city": "New York",
+        "state": "NY",
+        "country": "United States",
+        "postal_code": "10001"
+    }
+    response.raise_for_status.return_value = None
+    return response
+
+@pytest.fixture(scope="session")
+def credit_card_response():
+    """Random Data API credit card response shared by the flow tests."""
+    response = MagicMock()
+    response.json.return_value = {
+        "credit_card_number": "4532-1234-5678-9012",
+        "credit_card_type": "visa",
+        "credit_card_expiry_date": "12/25"
+    }
+    response.raise_for_status.return_value = None
+    return response
+
 class TestIntegrationFlow:
     """Test complete application flow."""
     
-    def test_complete_data_flow(self, test_db, mock_requests):
+    def test_complete_data_flow(self, test_db, mock_requests, users_response, address_response, credit_card_response, assert_max_queries):
         """Test complete data flow from users to addresses to credit cards."""
-        # Mock API responses
-        users_response = MagicMock()
-        users_response.json.return_value = [
-            {
-                "id": 1,
-                "name": "John Doe",
-                "username": "johndoe",
-                "email": "john@example.com",
-                "phone": "123-456-7890",
-                "website": "johndoe.com",
-                "company": {
-                    "name": "Test Company",
-                    "catchPhrase": "Test Catchphrase",
-                    "bs": "Test BS"
-                }
-            }
-        ]
-        users_response.raise_for_status.return_value = None
-        
-        address_response = MagicMock()
-        address_response.json.return_value = {
-            "street_number": "123",
-            "street_name": "Main Street",
-            "city": "New York",
-            "state": "NY",
-            "country": "United States",
-            "postal_code": "10001"
-        }
-        address_response.raise_for_status.return_value = None
-        
-        credit_card_response = MagicMock()
-        credit_card_response.json.return_value = {
-            "credit_card_number": "4532-1234-5678-9012",
-            "credit_card_type": "visa",
-            "credit_card_expiry_date": "12/25"
-        }
-        credit_card_response.raise_for_status.return_value = None
-        
         # Configure mock to return different responses for different URLs
         def mock_get(url, **kwargs):
             if "jsonplaceholder" in url:
@@ -61,7 +72,9 @@ class TestIntegrationFlow:
         mock_requests.side_effect = mock_get
         
         # Step 1: Fetch users
-        users_result = fetch_users_task()
+        # One read plus one bulk write, however many rows the API returns
+        with assert_max_queries(2):
+            users_result = fetch_users_task()
         assert users_result['status'] == 'success'
         assert users_result['created'] == 1
         
@@ -72,29 +85,36 @@ class TestIntegrationFlow:
         assert user.email == "john@example.com"
         
         # Step 2: Fetch addresses
-        addresses_result = fetch_addresses_task()
+        # One read plus one bulk write, however many rows the API returns
+        with assert_max_queries(2):
+            addresses_result = fetch_addresses_task()
         assert addresses_result['status'] == 'success'
         assert addresses_result['addresses_created'] == 1
         
         # Verify address was created
-        user_with_relations = UserService.get_user_with_relations(user.id)
+        with assert_max_queries(3):
+            user_with_relations = UserService.get_user_with_relations(user.id)
         assert len(user_with_relations['addresses']) == 1
         assert user_with_relations['addresses'][0]['street_name'] == "Main Street"
         assert user_with_relations['addresses'][0]['city'] == "New York"
         
         # Step 3: Fetch credit cards
-        credit_cards_result = fetch_credit_cards_task()
+        # One read plus one bulk write, however many rows the API returns
+        with assert_max_queries(2):
+            credit_cards_result = fetch_credit_cards_task()
         assert credit_cards_result['status'] == 'success'
         assert credit_cards_result['credit_cards_created'] == 1
         
         # Verify credit card was created
-        user_with_relations = UserService.get_user_with_relations(user.id)
+        with assert_max_queries(3):
+            user_with_relations = UserService.get_user_with_relations(user.id)
         assert len(user_with_relations['credit_cards']) == 1
         assert user_with_relations['credit_cards'][0]['card_number'] == "4532-1234-5678-9012"
         assert user_with_relations['credit_cards'][0]['card_type'] == "visa"
         
         # Step 4: Verify final stats
-        stats = StatsService.get_comprehensive_stats()
+        with assert_max_queries(1):
+            stats = StatsService.get_comprehensive_stats()
         assert stats['total_users'] == 1
         assert stats['total_addresses'] == 1
         assert stats['total_credit_cards'] == 1
@@ -125,39 +145,9 @@ class TestIntegrationFlow:
         assert credit_cards_result['status'] == 'success'
         assert credit_cards_result['message'] == 'No users found'
     
-    def test_partial_api_failures(self, test_db, mock_requests):
+    def test_partial_api_failures(self, test_db, mock_requests, users_response, address_response):
         """Test handling partial API failures."""
-        # Mock successful users response
-        users_response = MagicMock()
-        users_response.json.return_value = [
-            {
-                "id": 1,
-                "name": "John Doe",
-                "username": "johndoe",
-                "email": "john@example.com",
-                "phone": "123-456-7890",
-                "website": "johndoe.com",
-                "company": {"name": "Test Company", "catchPhrase": "Test", "bs": "Test"}
-            }
-        ]
-        users_response.raise_for_status.return_value = None
-        
-        # Mock successful address response
-        address_response = MagicMock()
-        address_response.json.return_value = {
-            "street_number": "123",
-            "street_name": "Main Street",
-            "city": "New York",
-            "state": "NY",
-            "country": "United States",
-            "postal_code": "10001"
-        }
-        address_response.raise_for_status.return_value = None
-        
-        # Mock credit card API to fail
-        credit_card_response = MagicMock()
-        credit_card_response.side_effect = Exception("Credit Card API Error")
-        
+        # Credit card API fails while users and addresses succeed
         def mock_get(url, **kwargs):
             if "jsonplaceholder" in url:
                 return users_response
@@ -1,22 +1,14 @@
 """Tests for service layer."""
 import pytest
+from sqlalchemy import insert
 from app.services import UserService, AddressService, CreditCardService, StatsService
 from app.database import User, Address, CreditCard
 
 class TestUserService:
     """Test UserService."""
     
-    def test_get_user_by_external_id(self, test_db):
+    def test_get_user_by_external_id(self, test_db, basic_user):
         """Test getting user by external ID."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         found_user = UserService.get_user_by_external_id(1)
         assert found_user is not None
         assert found_user.external_id == 1
@@ -27,20 +19,11 @@ class TestUserService:
         found_user = UserService.get_user_by_external_id(999)
         assert found_user is None
     
-    def test_get_user_with_relations(self, test_db):
+    def test_get_user_with_relations(self, test_db, basic_user):
         """Test getting user with all relations."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         # Add address
         address = Address(
-            user_id=user.id,
+            user_id=basic_user.id,
             street_number="123",
             street_name="Main St",
             city="Test City",
@@ -48,19 +31,18 @@ class TestUserService:
             country="Test Country",
             postal_code="12345"
         )
-        test_db.add(address)
         
         # Add credit card
         credit_card = CreditCard(
-            user_id=user.id,
+            user_id=basic_user.id,
             card_number="1234-5678-9012-3456",
             card_type="visa",
             expiry_date="12/25"
         )
-        test_db.add(credit_card)
+        test_db.add_all([address, credit_card])
         test_db.commit()
         
-        user_data = UserService.get_user_with_relations(user.id)
+        user_data = UserService.get_user_with_relations(basic_user.id)
         
         assert user_data is not None
         assert user_data['name'] == "Test User"
@@ -69,6 +51,27 @@ class TestUserService:
         assert user_data['addresses'][0]['street_name'] == "Main St"
         assert user_data['credit_cards'][0]['card_number'] == "1234-5678-9012-3456"
     
+    def test_get_user_with_relations_query_count(self, test_db, basic_user, assert_max_queries):
+        """Test that loading relations does not issue a query per related row."""
+        test_db.execute(insert(Address), [
+            {"user_id": basic_user.id, "street_number": str(i), "street_name": "Main St",
+             "city": "Test City", "state": "TS", "country": "Test Country", "postal_code": "12345"}
+            for i in range(5)
+        ])
+        test_db.execute(insert(CreditCard), [
+            {"user_id": basic_user.id, "card_number": f"1234-5678-9012-345{i}",
+             "card_type": "visa", "expiry_date": "12/25"}
+            for i in range(5)
+        ])
+        test_db.commit()
+        
+        # One query for the user plus one per collection
+        with assert_max_queries(3):
+            user_data = UserService.get_user_with_relations(basic_user.id)
+        
+        assert len(user_data['addresses']) == 5
+        assert len(user_data['credit_cards']) == 5
+    
     def test_get_user_with_relations_not_found(self, test_db):
         """Test getting user with relations when user not found."""
         user_data = UserService.get_user_with_relations(999)
@@ -76,15 +79,15 @@ class TestUserService:
     
     def test_get_all_users(self, test_db):
         """Test getting all users with pagination."""
-        # Create multiple users
-        for i in range(5):
-            user = User(
-                external_id=i + 1,
-                name=f"User {i + 1}",
-                username=f"user{i + 1}",
-                email=f"user{i + 1}@example.com"
-            )
-            test_db.add(user)
+        # Create multiple users in one bulk INSERT
+        test_db.execute(insert(User), [
+            {
+                "external_id": i + 1,
+                "name": f"User {i + 1}",
+                "username": f"user{i + 1}",
+                "email": f"user{i + 1}@example.com"
+            } for i in range(5)
+        ])
         test_db.commit()
         
         users = UserService.get_all_users(limit=3, offset=0)
@@ -96,80 +99,71 @@ class TestUserService:
         assert len(users_page2) == 2
         assert users_page2[0]['name'] == "User 4"
 
+    def test_get_all_users_relation_counts(self, test_db, basic_user):
+        """Test that each user carries its address and credit card counts."""
+        test_db.execute(insert(Address), [
+            {"user_id": basic_user.id, "street_number": str(i), "street_name": "Main St", "city": "Test City"}
+            for i in range(2)
+        ])
+        test_db.execute(insert(CreditCard), [
+            {"user_id": basic_user.id, "card_number": f"1234-5678-9012-345{i}",
+             "card_type": "visa", "expiry_date": "12/25"}
+            for i in range(3)
+        ])
+        test_db.commit()
+        
+        users = UserService.get_all_users()
+        assert len(users) == 1
+        assert users[0]['addresses_count'] == 2
+        assert users[0]['credit_cards_count'] == 3
+
 class TestAddressService:
     """Test AddressService."""
     
-    def test_get_addresses_by_user_id(self, test_db):
+    def test_get_addresses_by_user_id(self, test_db, basic_user):
         """Test getting addresses by user ID."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
-        # Add multiple addresses
-        for i in range(3):
-            address = Address(
-                user_id=user.id,
-                street_number=str(100 + i),
-                street_name=f"Street {i + 1}",
-                city=f"City {i + 1}",
-                state="TS",
-                country="Test Country",
-                postal_code=f"1234{i}"
-            )
-            test_db.add(address)
+        # Add multiple addresses in one bulk INSERT
+        test_db.execute(insert(Address), [
+            {
+                "user_id": basic_user.id,
+                "street_number": str(100 + i),
+                "street_name": f"Street {i + 1}",
+                "city": f"City {i + 1}",
+                "state": "TS",
+                "country": "Test Country",
+                "postal_code": f"1234{i}"
+            } for i in range(3)
+        ])
         test_db.commit()
         
-        addresses = AddressService.get_addresses_by_user_id(user.id)
+        addresses = AddressService.get_addresses_by_user_id(basic_user.id)
         assert len(addresses) == 3
         assert addresses[0]['street_name'] == "Street 1"
         assert addresses[1]['street_name'] == "Street 2"
         assert addresses[2]['street_name'] == "Street 3"
     
-    def test_get_addresses_by_user_id_empty(self, test_db):
+    def test_get_addresses_by_user_id_empty(self, test_db, basic_user):
         """Test getting addresses when user has none."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
-        addresses = AddressService.get_addresses_by_user_id(user.id)
+        addresses = AddressService.get_addresses_by_user_id(basic_user.id)
         assert len(addresses) == 0
 
 class TestCreditCardService:
     """Test CreditCardService."""
     
-    def test_get_credit_cards_by_user_id(self, test_db):
+    def test_get_credit_cards_by_user_id(self, test_db, basic_user):
         """Test getting credit cards by user ID."""
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
-        # Add multiple credit cards
-        for i in range(2):
-            credit_card = CreditCard(
-                user_id=user.id,
-                card_number=f"1234-5678-9012-345{i}",
-                card_type="visa",
-                expiry_date=f"12/2{i}"
-            )
-            test_db.add(credit_card)
+        # Add multiple credit cards in one bulk INSERT
+        test_db.execute(insert(CreditCard), [
+            {
+                "user_id": basic_user.id,
+                "card_number": f"1234-5678-9012-345{i}",
+                "card_type": "visa",
+                "expiry_date": f"12/2{i}"
+            } for i in range(2)
+        ])
         test_db.commit()
         
-        credit_cards = CreditCardService.get_credit_cards_by_user_id(user.id)
+        credit_cards = CreditCardService.get_credit_cards_by_user_id(basic_user.id)
         assert len(credit_cards) == 2
         assert credit_cards[0]['card_number'] == "1234-5678-9012-3450"
         assert credit_cards[1]['card_number'] == "1234-5678-9012-3451"
@@ -191,7 +185,7 @@ class TestStatsService:
         assert stats['coverage_stats']['credit_card_coverage_percent'] == 0
         assert stats['coverage_stats']['full_coverage_percent'] == 0
     
-    def test_get_comprehensive_stats_with_data(self, test_db):
+    def test_get_comprehensive_stats_with_data(self, test_db, assert_max_queries):
         """Test getting stats with data."""
         # Create users
         user1 = User(
@@ -206,29 +200,26 @@ class TestStatsService:
             username="user2",
             email="user2@example.com"
         )
-        test_db.add_all([user1, user2])
-        test_db.commit()
         
-        # Add address for user1
+        # Add address and credit card for user1 (linked through the relationship,
+        # so everything is written by a single commit)
         address = Address(
-            user_id=user1.id,
+            user=user1,
             street_number="123",
             street_name="Main St",
             city="Test City"
         )
-        test_db.add(address)
-        
-        # Add credit card for user1
         credit_card = CreditCard(
-            user_id=user1.id,
+            user=user1,
             card_number="1234-5678-9012-3456",
             card_type="visa",
             expiry_date="12/25"
         )
-        test_db.add(credit_card)
+        test_db.add_all([user1, user2, address, credit_card])
         test_db.commit()
         
-        stats = StatsService.get_comprehensive_stats()
+        with assert_max_queries(1):
+            stats = StatsService.get_comprehensive_stats()
         
         assert stats['total_users'] == 2
         assert stats['total_addresses'] == 1
@@ -239,3 +230,24 @@ class TestStatsService:
         assert stats['coverage_stats']['address_coverage_percent'] == 50.0
         assert stats['coverage_stats']['credit_card_coverage_percent'] == 50.0
         assert stats['coverage_stats']['full_coverage_percent'] == 50.0
+    
+    def test_get_comprehensive_stats_counts_users_once(self, test_db, basic_user):
+        """Test that users with several addresses and cards are counted once."""
+        test_db.execute(insert(Address), [
+            {"user_id": basic_user.id, "street_number": str(i), "street_name": "Main St", "city": "Test City"}
+            for i in range(3)
+        ])
+        test_db.execute(insert(CreditCard), [
+            {"user_id": basic_user.id, "card_number": f"1234-5678-9012-345{i}",
+             "card_type": "visa", "expiry_date": "12/25"}
+            for i in range(3)
+        ])
+        test_db.commit()
+        
+        stats = StatsService.get_comprehensive_stats()
+        
+        assert stats['total_addresses'] == 3
+        assert stats['total_credit_cards'] == 3
+        assert stats['users_with_addresses'] == 1
+        assert stats['users_with_credit_cards'] == 1
+        assert stats['users_with_both'] == 1
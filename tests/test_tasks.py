@@ -1,8 +1,11 @@
 """Tests for Celery tasks."""
 import pytest
+import requests
+from datetime import datetime
 from unittest.mock import patch, MagicMock
-from app.tasks import fetch_users_task, fetch_addresses_task, fetch_credit_cards_task, get_user_stats
+from app.tasks import fetch_users_task, fetch_addresses_task, fetch_credit_cards_task, get_user_stats, _table_row_counts
 from app.database import User, Address, CreditCard
+from app.config import Config
 
 class TestFetchUsersTask:
     """Test fetch_users_task."""
@@ -43,11 +46,97 @@ class TestFetchUsersTask:
         assert result['created'] == 0
         assert result['updated'] == 1
         
-        # Check user was updated
+        # Check user was updated (the task wrote through its own session)
+        test_db.expire_all()
         updated_user = test_db.query(User).filter(User.external_id == 1).first()
         assert updated_user.name == sample_user_data['name']
         assert updated_user.email == sample_user_data['email']
     
+    def test_fetch_users_inserted_in_external_id_order(self, test_db, mock_requests, sample_user_data, assert_max_queries):
+        """Test that users are inserted in external_id order regardless of API order."""
+        mock_requests.return_value.json.return_value = [
+            {**sample_user_data, "id": i, "username": f"user{i}", "email": f"user{i}@example.com"}
+            for i in (3, 1, 2)
+        ]
+        
+        # One lookup and one upsert for the whole batch
+        with assert_max_queries(2):
+            result = fetch_users_task()
+        
+        assert result['created'] == 3
+        users = test_db.query(User).order_by(User.id).all()
+        assert [user.external_id for user in users] == [1, 2, 3]
+    
+    def test_fetch_users_duplicate_ids_last_wins(self, test_db, mock_requests, sample_user_data, assert_max_queries):
+        """Test that a payload repeating an id stores one user from its last occurrence."""
+        mock_requests.return_value.json.return_value = [
+            {**sample_user_data, "id": 1, "name": "First Copy"},
+            {**sample_user_data, "id": 2, "username": "user2", "email": "user2@example.com"},
+            {**sample_user_data, "id": 1, "name": "Last Copy"}
+        ]
+        
+        # Still one lookup and one upsert: duplicates are collapsed before the statement
+        with assert_max_queries(2):
+            result = fetch_users_task()
+        
+        assert result['created'] == 2
+        assert result['updated'] == 0
+        assert result['total_processed'] == 3
+        users = test_db.query(User).order_by(User.external_id).all()
+        assert [user.external_id for user in users] == [1, 2]
+        assert users[0].name == "Last Copy"
+    
+    def test_fetch_users_skips_conflicting_rows(self, test_db, mock_requests, sample_user_data, caplog):
+        """Test that a username clash only drops the offending row from the batch."""
+        test_db.add_all([
+            User(external_id=10, name="Existing", username="existing", email="existing@example.com"),
+            User(external_id=20, name="Taken", username="taken", email="taken@example.com")
+        ])
+        test_db.commit()
+        mock_requests.return_value.json.return_value = [
+            # New user whose username belongs to external_id 20: rejected
+            {**sample_user_data, "id": 1, "username": "taken", "email": "new1@example.com"},
+            # New user: created
+            {**sample_user_data, "id": 2, "username": "user2", "email": "user2@example.com"},
+            # Existing user: updated
+            {**sample_user_data, "id": 10, "username": "existing", "email": "existing@example.com"}
+        ]
+        
+        result = fetch_users_task()
+        
+        assert result['status'] == 'success'
+        assert result['created'] == 1
+        assert result['updated'] == 1
+        assert result['total_processed'] == 3
+        assert "retrying per row" in caplog.text
+        test_db.expire_all()
+        users = {user.external_id: user for user in test_db.query(User)}
+        assert set(users) == {2, 10, 20}
+        assert users[10].name == sample_user_data['name']
+        assert users[20].name == "Taken"
+    
+    def test_fetch_users_upsert_timestamps(self, test_db, mock_requests, sample_user_data):
+        """Test that the upsert stamps new rows and bumps only updated_at on existing ones."""
+        long_ago = datetime(2020, 1, 1)
+        test_db.add(User(
+            external_id=1, name="Old Name", username="olduser", email="old@example.com",
+            created_at=long_ago, updated_at=long_ago
+        ))
+        test_db.commit()
+        mock_requests.return_value.json.return_value = [
+            sample_user_data,
+            {**sample_user_data, "id": 2, "username": "user2", "email": "user2@example.com"}
+        ]
+        
+        fetch_users_task()
+        
+        test_db.expire_all()
+        updated, created = test_db.query(User).order_by(User.external_id).all()
+        assert updated.created_at.replace(tzinfo=None) == long_ago
+        assert updated.updated_at.replace(tzinfo=None) > long_ago
+        assert created.created_at is not None
+        assert created.updated_at is not None
+    
     def test_fetch_users_api_error(self, mock_requests):
         """Test handling API errors."""
         mock_requests.side_effect = Exception("API Error")
@@ -57,7 +146,6 @@ class TestFetchUsersTask:
     
     def test_fetch_users_request_timeout(self, mock_requests):
         """Test handling request timeout."""
-        import requests
         mock_requests.side_effect = requests.RequestException("Timeout")
         
         with pytest.raises(Exception):
@@ -66,18 +154,8 @@ class TestFetchUsersTask:
 class TestFetchAddressesTask:
     """Test fetch_addresses_task."""
     
-    def test_fetch_addresses_success(self, test_db, mock_requests, mock_address_response, sample_address_data):
+    def test_fetch_addresses_success(self, test_db, basic_user, mock_requests, mock_address_response, sample_address_data):
         """Test successful address fetching."""
-        # Create a user first
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         mock_requests.return_value = mock_address_response
         
         result = fetch_addresses_task()
@@ -86,7 +164,7 @@ class TestFetchAddressesTask:
         assert result['addresses_created'] == 1
         
         # Check address was created
-        address = test_db.query(Address).filter(Address.user_id == user.id).first()
+        address = test_db.query(Address).filter(Address.user_id == basic_user.id).first()
         assert address is not None
         assert address.street_name == sample_address_data['street_name']
         assert address.city == sample_address_data['city']
@@ -99,18 +177,8 @@ class TestFetchAddressesTask:
         assert result['message'] == 'No users found'
         assert result['addresses_created'] == 0
     
-    def test_fetch_addresses_api_error(self, test_db, mock_requests):
+    def test_fetch_addresses_api_error(self, test_db, basic_user, mock_requests):
         """Test handling API errors in address fetching."""
-        # Create a user first
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         mock_requests.side_effect = Exception("API Error")
         
         result = fetch_addresses_task()
@@ -119,21 +187,81 @@ class TestFetchAddressesTask:
         assert result['status'] == 'success'
         assert result['addresses_created'] == 0
 
-class TestFetchCreditCardsTask:
-    """Test fetch_credit_cards_task."""
+    def test_fetch_addresses_batches_requests(self, test_db, mock_requests, sample_address_data, assert_max_queries):
+        """Test that a chunk of users is served by one paged request."""
+        test_db.add_all([
+            User(external_id=i, name=f"User {i}", username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(1, 4)
+        ])
+        test_db.commit()
+        mock_requests.return_value.json.return_value = [sample_address_data] * 3
+        
+        # One user id query and one executemany INSERT for the whole chunk
+        with assert_max_queries(2):
+            result = fetch_addresses_task()
+        
+        assert result['addresses_created'] == 3
+        assert mock_requests.call_count == 1
+        assert mock_requests.call_args.kwargs['params'] == {'size': 3}
+        assert test_db.query(Address).count() == 3
+
+    def test_fetch_addresses_retries_when_insert_fails(self, test_db, basic_user, mock_requests, mock_address_response):
+        """Test that a failing insert in an inline chunk retries the whole load."""
+        mock_requests.return_value = mock_address_response
+        insert_error = Exception("database unavailable")
+        
+        with patch('app.tasks._bulk_insert', side_effect=insert_error), \
+                patch.object(fetch_addresses_task, 'retry', return_value=RuntimeError("retry scheduled")) as retry:
+            with pytest.raises(RuntimeError, match="retry scheduled"):
+                fetch_addresses_task()
+        
+        retry.assert_called_once()
+        assert retry.call_args.kwargs['exc'] is insert_error
     
-    def test_fetch_credit_cards_success(self, test_db, mock_requests, mock_credit_card_response, sample_credit_card_data):
-        """Test successful credit card fetching."""
-        # Create a user first
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
+    def test_fetch_addresses_fans_out_chunks(self, test_db, celery_app_test, mock_requests, sample_address_data):
+        """Test that several chunks report one summed result like a single chunk."""
+        test_db.add_all([
+            User(external_id=i, name=f"User {i}", username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(1, 6)
+        ])
+        test_db.commit()
+        mock_requests.side_effect = lambda url, params=None, **kwargs: MagicMock(
+            **{'json.return_value': [sample_address_data] * params['size']}
         )
-        test_db.add(user)
+        
+        with patch.object(Config, 'FETCH_CHUNK_SIZE', 2):
+            direct_result = fetch_addresses_task()
+            applied_result = fetch_addresses_task.apply().get()
+        
+        expected = {'status': 'success', 'addresses_created': 5, 'users_processed': 5}
+        assert direct_result == expected
+        assert applied_result == expected
+        assert mock_requests.call_count == 6
+        assert test_db.query(Address).count() == 10
+
+    def test_fetch_addresses_analyzes_once_per_load(self, test_db, celery_app_test, mock_requests, sample_address_data):
+        """Test that table statistics are refreshed once after all chunks, not per chunk."""
+        test_db.add_all([
+            User(external_id=i, name=f"User {i}", username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(1, 6)
+        ])
         test_db.commit()
+        mock_requests.side_effect = lambda url, params=None, **kwargs: MagicMock(
+            **{'json.return_value': [sample_address_data] * params['size']}
+        )
+        
+        with patch.object(Config, 'FETCH_CHUNK_SIZE', 2), \
+                patch('app.tasks._refresh_table_stats') as refresh:
+            fetch_addresses_task()
         
+        refresh.assert_called_once()
+        assert refresh.call_args.args[1] is Address
+
+class TestFetchCreditCardsTask:
+    """Test fetch_credit_cards_task."""
+    
+    def test_fetch_credit_cards_success(self, test_db, basic_user, mock_requests, mock_credit_card_response, sample_credit_card_data):
+        """Test successful credit card fetching."""
         mock_requests.return_value = mock_credit_card_response
         
         result = fetch_credit_cards_task()
@@ -142,7 +270,7 @@ class TestFetchCreditCardsTask:
         assert result['credit_cards_created'] == 1
         
         # Check credit card was created
-        credit_card = test_db.query(CreditCard).filter(CreditCard.user_id == user.id).first()
+        credit_card = test_db.query(CreditCard).filter(CreditCard.user_id == basic_user.id).first()
         assert credit_card is not None
         assert credit_card.card_number == sample_credit_card_data['credit_card_number']
         assert credit_card.card_type == sample_credit_card_data['credit_card_type']
@@ -166,35 +294,24 @@ class TestGetUserStatsTask:
         assert result['total_addresses'] == 0
         assert result['total_credit_cards'] == 0
     
-    def test_get_user_stats_with_data(self, test_db):
+    def test_get_user_stats_with_data(self, test_db, basic_user):
         """Test getting stats with data."""
-        # Create user
-        user = User(
-            external_id=1,
-            name="Test User",
-            username="testuser",
-            email="test@example.com"
-        )
-        test_db.add(user)
-        test_db.commit()
-        
         # Create address
         address = Address(
-            user_id=user.id,
+            user_id=basic_user.id,
             street_number="123",
             street_name="Main St",
             city="Test City"
         )
-        test_db.add(address)
         
         # Create credit card
         credit_card = CreditCard(
-            user_id=user.id,
+            user_id=basic_user.id,
             card_number="1234-5678-9012-3456",
             card_type="visa",
             expiry_date="12/25"
         )
-        test_db.add(credit_card)
+        test_db.add_all([address, credit_card])
         test_db.commit()
         
         result = get_user_stats()
@@ -202,3 +319,30 @@ class TestGetUserStatsTask:
         assert result['total_users'] == 1
         assert result['total_addresses'] == 1
         assert result['total_credit_cards'] == 1
+
+class TestTableRowCounts:
+    """Test _table_row_counts on PostgreSQL."""
+    
+    def test_uses_planner_estimates(self):
+        """Test that analysed tables are counted from pg_class.reltuples."""
+        db = MagicMock()
+        db.execute.return_value = [("users", 120), ("addresses", 340), ("credit_cards", 560)]
+        
+        with patch('app.tasks._is_postgres', return_value=True):
+            counts = _table_row_counts(db, (User, Address, CreditCard))
+        
+        assert counts == {'users': 120, 'addresses': 340, 'credit_cards': 560}
+        assert db.execute.call_args.args[1] == {'names': ['users', 'addresses', 'credit_cards']}
+        db.query.assert_not_called()
+    
+    def test_falls_back_to_count_for_unanalysed_tables(self):
+        """Test that -1/0 estimates (never analysed) and missing rows use an exact COUNT(*)."""
+        db = MagicMock()
+        db.execute.return_value = [("users", 120), ("addresses", -1), ("credit_cards", 0)]
+        db.query.return_value.count.return_value = 7
+        
+        with patch('app.tasks._is_postgres', return_value=True):
+            counts = _table_row_counts(db, (User, Address, CreditCard))
+        
+        assert counts == {'users': 120, 'addresses': 7, 'credit_cards': 7}
+        assert [call.args[0] for call in db.query.call_args_list] == [Address, CreditCard]